@@ -2,18 +2,26 @@
 Aplicação Streamlit para visualização de alocação de equipe e férias.
 Versão Otimizada
 """
+import hashlib
+import importlib.util
+import os
 import warnings
 from datetime import datetime, timedelta, date
-from typing import Dict, List, Optional, Tuple, Set
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 
 # Suprimir avisos específicos do Excel
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
+# Copy-on-Write: fatias filtradas só são copiadas se forem escritas (padrão no pandas >= 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # --- CONFIGURAÇÃO ---
 class Config:
     """Configurações e constantes da aplicação."""
@@ -22,8 +30,18 @@ class Config:
     FILE_PATH_FERIAS = 'Férias.xlsx'
     FILE_PATH_GERAL = 'Planejamento Geral.xlsx'
 
+    # Leitura (calamine é um parser em Rust, bem mais rápido que o openpyxl;
+    # openpyxl fica como alternativa se python-calamine não estiver instalado)
+    EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+    # Cache em disco dos dados já processados (Feather), chaveado pelo hash do Excel.
+    # Incrementar CACHE_VERSION sempre que a saída dos _parse_* mudar.
+    CACHE_DIR = '.cache'
+    CACHE_VERSION = 1
+
     # Visualização
     EXTENDED_LOOKAHEAD_DAYS = 330
+    EXTENDED_LOOKBEHIND_DAYS = 30
     
     # Cores
     COLOR_TODAY_LINE = "red"
@@ -46,6 +64,10 @@ class Config:
     # Ordem Lógica
     DISCIPLINA_ORDER = ["ELET", "INST", "MEC"]
 
+    # Esquema fixo das fontes de eventos antes do enriquecimento
+    # (Nome não entra: o nome oficial vem da equipe, via Matrícula)
+    EVENT_COLUMNS = ['Matrícula', 'Início', 'Término', 'Tipo', 'Detalhamento']
+
 
 # --- CARREGAMENTO DE DADOS ---
 class DataLoader:
@@ -53,46 +75,85 @@ class DataLoader:
 
     @staticmethod
     def _normalize_dates(df: pd.DataFrame, cols: List[str]) -> pd.DataFrame:
-        """Converte colunas para datetime de forma segura e vetorizada."""
+        """
+        Converte colunas para datetime de forma segura e vetorizada.
+        Colunas que o calamine já entrega como datetime64 são mantidas sem nova conversão.
+        """
         for col in cols:
-            if col in df.columns:
+            if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
                 df[col] = pd.to_datetime(df[col], errors='coerce')
         return df
 
+    @staticmethod
+    def _normalize_keys(df: pd.DataFrame) -> pd.DataFrame:
+        """Converte as chaves de junção/filtro para tipos compactos (Int64 e category)."""
+        if 'Matrícula' in df.columns:
+            df['Matrícula'] = pd.to_numeric(df['Matrícula'], errors='coerce').astype('Int64')
+        if 'Tipo' in df.columns:
+            df['Tipo'] = df['Tipo'].astype('category')
+        return df
+
+    @staticmethod
+    def _with_disk_cache(src: str, parse: Callable[[], Tuple[pd.DataFrame, ...]],
+                         n_frames: int) -> Tuple[pd.DataFrame, ...]:
+        """
+        Retorna os `n_frames` DataFrames de `parse` usando um cache Feather em disco.
+        A chave é o SHA1 do conteúdo do Excel, então o cache é compartilhado entre
+        processos/workers e sobrevive a reinícios enquanto o arquivo não mudar.
+        Cache incompleto ou ilegível é ignorado: volta-se a ler o Excel.
+        """
+        stem = Path(src).stem
+        cache_dir = Path(Config.CACHE_DIR)
+        hasher = hashlib.sha1(Path(src).read_bytes())
+        hasher.update(str(Config.CACHE_VERSION).encode())
+        digest = hasher.hexdigest()[:16]
+        paths = [cache_dir / f"{stem}_{digest}_{i}.feather" for i in range(n_frames)]
+
+        # Só é acerto com todos os arquivos presentes (um por DataFrame retornado)
+        if all(p.exists() for p in paths):
+            try:
+                return tuple(pd.read_feather(p) for p in paths)
+            except Exception:
+                pass
+
+        dfs = tuple(df.reset_index(drop=True) for df in parse())
+
+        # Falha ao gravar o cache não deve impedir o carregamento
+        try:
+            cache_dir.mkdir(exist_ok=True)
+            for i, df in enumerate(dfs):
+                # Escrita atômica: outro worker nunca lê um arquivo pela metade
+                tmp = cache_dir / f".{stem}_{digest}_{i}.{os.getpid()}.tmp"
+                df.to_feather(tmp)
+                os.replace(tmp, paths[i])
+            # Remove apenas versões antigas (outro digest); as do digest atual podem
+            # ter acabado de ser gravadas por outro worker
+            for p in cache_dir.glob(f"{stem}_*.feather"):
+                if not p.name.startswith(f"{stem}_{digest}_"):
+                    p.unlink(missing_ok=True)
+        except Exception:
+            pass
+
+        return dfs
+
+    @staticmethod
+    def file_mtime(path: str) -> Optional[float]:
+        """
+        Data de modificação do arquivo, usada como chave dos loaders em cache:
+        se a planilha for salva de novo, o próximo rerun recarrega sem esperar o TTL.
+        """
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
     @staticmethod
     @st.cache_data(ttl=3600) # Cache por 1 hora
-    def load_estaleiro_data() -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
+    def load_estaleiro_data(mtime: Optional[float] = None) -> Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]:
         try:
-            # Equipe
-            equipe_df = pd.read_excel(Config.FILE_PATH_ESTALEIRO, sheet_name='Equipe')
-            # Seleção robusta por posição, mas validando nomes
-            equipe_df = equipe_df.iloc[:, [0, 1, 3, 4, 5, 7]]
-            equipe_df.columns = ['Disciplina', 'Matrícula', 'Função', 'Projeto', 'Experiência', 'Nome']
-            equipe_df = equipe_df.dropna(subset=['Experiência']) # Baseado na col 4 original
-
-            # Otimização de memória
-            for col in ['Disciplina', 'Função', 'Projeto']:
-                equipe_df[col] = equipe_df[col].astype('category')
-
-            # Planejamento
-            plan_df = pd.read_excel(
-                Config.FILE_PATH_ESTALEIRO, 
-                sheet_name='Planejamento IED', 
-                skiprows=8, 
-                usecols="C:E"
-            )
-            plan_df.columns = ['Nome', 'Início', 'Término']
-            plan_df = plan_df.dropna(subset=['Nome'])
-            plan_df = DataLoader._normalize_dates(plan_df, ['Início', 'Término'])
-
-            # Merge Otimizado
-            plan_df = plan_df.merge(
-                equipe_df[['Nome', 'Matrícula', 'Disciplina', 'Função', 'Projeto']],
-                on='Nome',
-                how='left'
+            equipe_df, plan_df = DataLoader._with_disk_cache(
+                Config.FILE_PATH_ESTALEIRO, DataLoader._parse_estaleiro, n_frames=2
             )
-            plan_df['Tipo'] = 'Estaleiro'
-
             return equipe_df, plan_df
 
         except Exception as e:
@@ -101,118 +162,181 @@ class DataLoader:
 
     @staticmethod
     @st.cache_data(ttl=3600)
-    def load_ferias_data() -> Optional[pd.DataFrame]:
+    def load_ferias_data(mtime: Optional[float] = None) -> Optional[pd.DataFrame]:
         try:
-            df = pd.read_excel(Config.FILE_PATH_FERIAS, skiprows=1, header=None)
-            
-            # 1. Seleção das colunas (Matrícula + 3 parcelas de Início/Término)
-            cols_idx = [0, 8, 9, 11, 12, 14, 15]
-            col_names = [
-                "Matrícula", 
-                "Início_1", "Término_1", 
-                "Início_2", "Término_2", 
-                "Início_3", "Término_3"
-            ]
-            df = df.iloc[:, cols_idx].copy()
-            df.columns = col_names
-
-            # --- SOLUÇÃO PARA O ERRO DE ID ÚNICO ---
-            # Criamos um ID de linha único para que o Pandas saiba diferenciar 
-            # registros diferentes da mesma matrícula durante o "melt"
-            df['row_id'] = range(len(df))
-
-            # 2. Reshape (Wide to Long) usando 'row_id' e 'Matrícula' como identificadores
-            df_long = pd.wide_to_long(
-                df, 
-                stubnames=["Início", "Término"], 
-                i=["row_id", "Matrícula"], # O par (row_id, Matrícula) agora é único
-                j="Parcela", 
-                sep="_", 
-                suffix=r'\d+'
-            ).reset_index()
-
-            # 3. Limpeza e Normalização
-            df_long = df_long.dropna(subset=["Início"])
-            df_long['Tipo'] = "Férias"
-            
-            # Converte datas de forma segura
-            df_long = DataLoader._normalize_dates(df_long, ['Início', 'Término'])
-            
-            # Removemos o row_id pois ele não é mais necessário após o processamento
-            df_long.drop(columns=['row_id', 'Parcela'], inplace=True)
-            
-            return df_long
+            (df,) = DataLoader._with_disk_cache(Config.FILE_PATH_FERIAS, DataLoader._parse_ferias, n_frames=1)
+            return df
 
         except Exception as e:
             st.error(f"Erro ao carregar Férias: {e}")
             return None
-        
+
     @staticmethod
     @st.cache_data(ttl=3600)
-    def load_planejamento_geral() -> Optional[pd.DataFrame]:
+    def load_planejamento_geral(mtime: Optional[float] = None) -> Optional[pd.DataFrame]:
         try:
-            df = pd.read_excel(
-                Config.FILE_PATH_GERAL,
-                usecols=["Nome", "Matrícula", "Início", "Término", "Atividade", "Detalhamento"]
-            )
-            df = df.rename(columns={'Atividade': 'Tipo'})
-            df = DataLoader._normalize_dates(df, ['Início', 'Término'])
+            (df,) = DataLoader._with_disk_cache(Config.FILE_PATH_GERAL, DataLoader._parse_geral, n_frames=1)
             return df
         except Exception as e:
             st.error(f"Erro ao carregar Planejamento Geral: {e}")
             return None
 
+    @staticmethod
+    def _parse_estaleiro() -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Lê a equipe e o planejamento do Estaleiro."""
+        # Abre o arquivo uma única vez para as duas planilhas
+        with pd.ExcelFile(Config.FILE_PATH_ESTALEIRO, engine=Config.EXCEL_ENGINE) as xls:
+            # Seleção por posição já na leitura (Disciplina, Matrícula, Função, Projeto, Experiência, Nome)
+            equipe_df = xls.parse(sheet_name='Equipe', usecols=[0, 1, 3, 4, 5, 7])
+            plan_df = xls.parse(
+                sheet_name='Planejamento IED', 
+                skiprows=8, 
+                usecols="C:E"
+            )
+
+        # Equipe
+        equipe_df.columns = ['Disciplina', 'Matrícula', 'Função', 'Projeto', 'Experiência', 'Nome']
+        equipe_df = equipe_df.dropna(subset=['Experiência']) # Baseado na col 4 original
+        equipe_df = DataLoader._normalize_keys(equipe_df)
+
+        # Otimização de memória (um único astype para as três colunas)
+        equipe_df = equipe_df.astype(
+            {'Disciplina': 'category', 'Função': 'category', 'Projeto': 'category'}
+        )
+
+        # Ordenação do gráfico feita uma vez na carga (filtros booleanos preservam a ordem)
+        disciplina_type = pd.CategoricalDtype(Config.DISCIPLINA_ORDER, ordered=True)
+        equipe_df = equipe_df.sort_values(
+            by=['Disciplina', 'Função', 'Projeto', 'Nome'],
+            key=lambda col: col.astype(disciplina_type) if col.name == 'Disciplina' else col
+        ).reset_index(drop=True)
+
+        # Planejamento
+        plan_df.columns = ['Nome', 'Início', 'Término']
+        plan_df = plan_df.dropna(subset=['Nome'])
+        plan_df = DataLoader._normalize_dates(plan_df, ['Início', 'Término'])
+
+        # Enriquecer por Nome com map (sem o join intermediário do merge)
+        lookup = equipe_df.drop_duplicates(subset=['Nome']).set_index('Nome')
+        for col in ['Matrícula', 'Disciplina', 'Função', 'Projeto']:
+            plan_df[col] = plan_df['Nome'].map(lookup[col])
+        plan_df['Tipo'] = 'Estaleiro'
+        plan_df = DataLoader._normalize_keys(plan_df)
+
+        return equipe_df, plan_df
+
+    @staticmethod
+    def _parse_ferias() -> Tuple[pd.DataFrame]:
+        """Lê as férias, uma linha por parcela."""
+        # 1. Seleção das colunas na leitura (Matrícula + 3 parcelas de Início/Término)
+        cols_idx = [0, 8, 9, 11, 12, 14, 15]
+        col_names = [
+            "Matrícula", 
+            "Início_1", "Término_1", 
+            "Início_2", "Término_2", 
+            "Início_3", "Término_3"
+        ]
+        df = pd.read_excel(
+            Config.FILE_PATH_FERIAS, skiprows=1, header=None,
+            usecols=cols_idx, names=col_names,
+            engine=Config.EXCEL_ENGINE
+        )
+
+        # Converte cada coluna de data antes de empilhar: uma parcela inteira em branco
+        # vem como float (NaN) e não pode ser concatenada com colunas datetime64
+        df = DataLoader._normalize_dates(df, col_names[1:])
+
+        # 2. Reshape (Wide to Long): empilha as 3 parcelas em uma única alocação
+        parcelas = (1, 2, 3)
+        df_long = pd.DataFrame({
+            "Matrícula": np.tile(df["Matrícula"].to_numpy(), len(parcelas)),
+            "Início": np.concatenate([df[f"Início_{p}"].to_numpy() for p in parcelas]),
+            "Término": np.concatenate([df[f"Término_{p}"].to_numpy() for p in parcelas]),
+        })
+
+        # 3. Limpeza e Normalização
+        df_long = df_long.dropna(subset=["Início"])
+        df_long['Tipo'] = "Férias"
+        df_long = DataLoader._normalize_keys(df_long)
+        
+        return (df_long,)
+
+    @staticmethod
+    def _parse_geral() -> Tuple[pd.DataFrame]:
+        """Lê o Planejamento Geral."""
+        df = pd.read_excel(
+            Config.FILE_PATH_GERAL,
+            usecols=["Nome", "Matrícula", "Início", "Término", "Atividade", "Detalhamento"],
+            engine=Config.EXCEL_ENGINE
+        )
+        df = df.rename(columns={'Atividade': 'Tipo'})
+        df = DataLoader._normalize_dates(df, ['Início', 'Término'])
+        df = DataLoader._normalize_keys(df)
+        return (df,)
+
 
 # --- PROCESSAMENTO ---
 class DataProcessor:
     """Lógica de negócios e manipulação de dados."""
 
     @staticmethod
+    @st.cache_data(ttl=3600, show_spinner=False) # Reaproveitado entre reruns
     def prepare_combined_data(equipe_df: pd.DataFrame, 
-                              dfs_eventos: List[pd.DataFrame]) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        """Combina todas as fontes de dados em um único DataFrame normalizado."""
+                              dfs_eventos: List[pd.DataFrame],
+                              start_date: Optional[pd.Timestamp] = None,
+                              end_date: Optional[pd.Timestamp] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Combina todas as fontes de dados em um único DataFrame normalizado.
+        Se `start_date`/`end_date` forem informados, mantém apenas eventos que colidem
+        com essa janela (antes do concat, reduzindo todo o processamento seguinte).
+        """
         
         valid_dfs = []
-        matriculas_validas = set(equipe_df['Matrícula'])
+        matriculas_validas = equipe_df['Matrícula'].unique()
 
         for df in dfs_eventos:
             if df is not None and not df.empty:
-                # Filtrar apenas matrículas que existem na equipe atual
-                df_filtered = df[df['Matrícula'].isin(matriculas_validas)].copy()
-                
-                # Garantir colunas essenciais
-                cols_to_keep = ['Matrícula', 'Início', 'Término', 'Tipo']
-                if 'Nome' in df.columns: cols_to_keep.append('Nome')
-                if 'Detalhamento' in df.columns: cols_to_keep.append('Detalhamento')
+                # Filtrar apenas matrículas que existem na equipe atual (e eventos da janela)
+                mask = df['Matrícula'].isin(matriculas_validas)
+                if start_date is not None:
+                    mask &= df['Término'] >= start_date
+                if end_date is not None:
+                    mask &= df['Início'] <= end_date
+                df_filtered = df[mask]
                 
-                valid_dfs.append(df_filtered[cols_to_keep])
+                # Esquema fixo: o concat não precisa alinhar colunas heterogêneas
+                valid_dfs.append(df_filtered.reindex(columns=Config.EVENT_COLUMNS))
 
         if not valid_dfs:
-            combined = pd.DataFrame(columns=['Matrícula', 'Nome', 'Início', 'Término', 'Disciplina', 'Tipo'])
+            combined = pd.DataFrame(columns=Config.EVENT_COLUMNS)
         else:
-            combined = pd.concat(valid_dfs, ignore_index=True)
-
-        # Enriquecer com dados da equipe (Merge é mais rápido que iterrows)
-        combined = combined.merge(
-            equipe_df[['Matrícula', 'Nome', 'Disciplina', 'Função', 'Projeto']],
-            on='Matrícula',
-            how='left',
-            suffixes=('', '_eq')
+            # Mesmo CategoricalDtype em todas as fontes: o concat mantém Tipo como category
+            # (com categorias diferentes o resultado cairia para texto).
+            # As categorias começam pelo COLOR_MAP: ordem de traços/legenda determinística.
+            tipo_dtype = pd.CategoricalDtype(
+                pd.Index(list(Config.COLOR_MAP)).append(
+                    [d['Tipo'].astype('category').cat.categories for d in valid_dfs]
+                ).unique()
+            )
+            combined = pd.concat(
+                [d.astype({'Tipo': tipo_dtype}) for d in valid_dfs], ignore_index=True
+            )
+
+        # Enriquecer com dados da equipe: join contra o índice de Matrícula
+        # (o indexador é calculado uma única vez para todas as colunas).
+        # Matrícula repetida na equipe: vale a primeira linha, sem duplicar eventos.
+        lookup = equipe_df.drop_duplicates(subset=['Matrícula']).set_index('Matrícula')
+        combined = combined.join(
+            lookup[['Nome', 'Disciplina', 'Função', 'Projeto']],
+            on='Matrícula', how='left'
         )
-        
-        # Preencher Nome faltante se necessário
-        if 'Nome_eq' in combined.columns:
-            combined['Nome'] = combined['Nome'].fillna(combined['Nome_eq'])
-            combined.drop(columns=['Nome_eq'], inplace=True)
 
         # Ordenação para o Gráfico
         disciplina_type = pd.CategoricalDtype(Config.DISCIPLINA_ORDER, ordered=True)
         
-        # DataFrame de Membros Únicos Ordenados
-        unique_members = equipe_df.copy()
-        unique_members['Disciplina'] = unique_members['Disciplina'].astype(disciplina_type)
-        unique_members = unique_members.sort_values(
-            by=['Disciplina', 'Função', 'Projeto', 'Nome']
+        # DataFrame de Membros Únicos Ordenados (equipe_df já vem ordenada do loader)
+        unique_members = equipe_df.assign(
+            Disciplina=equipe_df['Disciplina'].astype(disciplina_type)
         ).reset_index(drop=True)
 
         # Ajustar combinado
@@ -221,118 +345,207 @@ class DataProcessor:
 
         return combined, unique_members
 
+    @staticmethod
+    def get_occupied_ids(combined_df: pd.DataFrame,
+                         start_date: pd.Timestamp, end_date: pd.Timestamp) -> np.ndarray:
+        """
+        Retorna as matrículas com algum evento que colide com o período.
+        Uma única máscara sobre todos os eventos, em vez de um filtro por membro.
+        O resultado é um array int64 (mesmo tipo da coluna), usado direto em `isin`.
+        """
+        if combined_df.empty:
+            return np.array([], dtype='int64')
+
+        # Máscara direto nos arrays datetime64 e um único passe indexado (sem fatiar o DataFrame)
+        mask_periodo = (
+            (combined_df['Início'].to_numpy() <= np.datetime64(end_date)) &
+            (combined_df['Término'].to_numpy() >= np.datetime64(start_date))
+        )
+        matriculas = combined_df['Matrícula'].array[mask_periodo].dropna()
+        return pd.unique(matriculas.to_numpy(dtype='int64'))
+
     @staticmethod
     def get_available_members(equipe_df: pd.DataFrame, combined_df: pd.DataFrame, 
                              start_date: pd.Timestamp, end_date: pd.Timestamp) -> pd.DataFrame:
         """
         Retorna apenas membros sem alocação no período.
-        Usa lógica de conjuntos para performance O(1) na verificação.
+        Usa `isin` contra o array de ocupados (tabela hash em C).
         """
         if combined_df.empty:
             return equipe_df
 
-        # Filtrar eventos que colidem com a janela de análise
-        mask_periodo = (
-            (combined_df['Início'] <= end_date) & 
-            (combined_df['Término'] >= start_date)
-        )
-        ocupados_ids = set(combined_df.loc[mask_periodo, 'Matrícula'].unique())
+        ocupados_ids = DataProcessor.get_occupied_ids(combined_df, start_date, end_date)
         
-        # Retorna apenas quem NÃO está no set de ocupados
-        return equipe_df[~equipe_df['Matrícula'].isin(ocupados_ids)].copy()
+        # Retorna apenas quem NÃO está entre os ocupados
+        return equipe_df[~equipe_df['Matrícula'].isin(ocupados_ids)]
 
     @staticmethod
+    def coalesce_events(combined_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Funde eventos contíguos ou sobrepostos do mesmo colaborador, tipo e detalhamento
+        em uma única barra (intervalos separados por até 1 dia são considerados contíguos).
+        """
+        if combined_df.empty:
+            return combined_df
+
+        keys = [c for c in ['Matrícula', 'Tipo', 'Detalhamento'] if c in combined_df.columns]
+        df = combined_df.sort_values(by=keys + ['Início'])
+        grupos = [df[k] for k in keys]
+
+        # Maior Término visto até a linha anterior, dentro do mesmo grupo
+        fim_anterior = (
+            df.groupby(grupos, observed=True, dropna=False, sort=False)['Término'].cummax()
+            .groupby(grupos, observed=True, dropna=False, sort=False).shift()
+        )
+        novo_bloco = fim_anterior.isna() | (df['Início'] > fim_anterior + pd.Timedelta(days=1))
+        bloco_id = novo_bloco.cumsum()
+
+        agregacoes = {col: 'first' for col in df.columns}
+        agregacoes.update({'Início': 'min', 'Término': 'max'})
+        return df.groupby(bloco_id, sort=False).agg(agregacoes).reset_index(drop=True)
+
+    @staticmethod
+    @st.cache_data(ttl=3600, show_spinner=False)
     def detect_conflicts_vectorized(combined_df: pd.DataFrame) -> pd.DataFrame:
         """
-        Detecta conflitos usando operações vetorizadas (shift) em vez de loops.
+        Detecta conflitos usando operações vetorizadas (self-merge por Matrícula) em vez de loops.
+        Compara todos os pares de eventos da mesma pessoa, não só os vizinhos: um evento
+        longo que cobre vários outros gera um conflito com cada um deles.
         Retorna um DataFrame com os conflitos.
         """
-        if combined_df.empty:
+        # Só quem tem 2+ eventos pode ter conflito: cruzar apenas esses candidatos
+        candidatos = combined_df['Matrícula'].duplicated(keep=False)
+        if not candidatos.any():
             return pd.DataFrame()
 
-        df = combined_df.sort_values(by=['Matrícula', 'Início'])
-        
-        # Criar colunas deslocadas para comparar linha atual com a próxima
-        df['Next_Inicio'] = df.groupby('Matrícula')['Início'].shift(-1)
-        df['Next_Tipo'] = df.groupby('Matrícula')['Tipo'].shift(-1)
+        df = combined_df.loc[candidatos, ['Matrícula', 'Nome', 'Início', 'Término', 'Tipo']]
+        df = df.sort_values(by=['Matrícula', 'Início'])
+        df['Ordem'] = np.arange(len(df))
+
+        # Todos os pares de eventos da mesma matrícula, cada par uma única vez (Ordem_1 < Ordem_2)
+        pares = df.merge(df.drop(columns='Nome'), on='Matrícula', suffixes=('', '_2'), sort=False)
+        pares = pares[pares['Ordem'] < pares['Ordem_2']]
         
-        # Lógica de conflito: Término Atual > Próximo Início (dentro da mesma matrícula)
+        # Lógica de conflito: Término Atual > Início do posterior (dentro da mesma matrícula)
         # Nota: Ajustar > ou >= dependendo se término no dia X e início no dia X é conflito.
         # Assumindo que sim para segurança.
-        conflict_mask = (df['Término'] > df['Next_Inicio']) & (df['Next_Inicio'].notna())
-        
-        conflicts = df[conflict_mask].copy()
+        conflicts = pares[pares['Término'] > pares['Início_2']].sort_values(by=['Ordem', 'Ordem_2'])
         
         if conflicts.empty:
             return pd.DataFrame()
 
-        # Formatar saída
-        saida = []
-        for _, row in conflicts.iterrows():
-            saida.append({
-                "Nome": row['Nome'],
-                "Conflito": f"{row['Tipo']} ({row['Término'].strftime('%d/%m')}) x {row['Next_Tipo']} ({row['Next_Inicio'].strftime('%d/%m')})"
-            })
-            
-        return pd.DataFrame(saida)
+        # Formatar saída com operações de string vetorizadas
+        return pd.DataFrame({
+            "Nome": conflicts['Nome'].to_numpy(),
+            "Conflito": (
+                conflicts['Tipo'].astype(str) + " (" + conflicts['Término'].dt.strftime('%d/%m') + ") x " +
+                conflicts['Tipo_2'].astype(str) + " (" + conflicts['Início_2'].dt.strftime('%d/%m') + ")"
+            ).to_numpy()
+        })
 
 
 # --- VISUALIZAÇÃO ---
 class Visualizer:
     @staticmethod
+    @st.cache_data(ttl=3600, show_spinner=False) # Mesmos filtros -> mesma figura, sem reconstruir
     def create_gantt_chart(combined_df: pd.DataFrame, unique_members: pd.DataFrame,
                           start_date: pd.Timestamp, end_date: pd.Timestamp, 
-                          occupied_ids: Set) -> go.Figure:
+                          occupied_ids: np.ndarray) -> go.Figure:
         
         y_order = unique_members['Nome'].tolist()
         
-        # Criar labels coloridos HTML
-        y_labels = []
-        for nome, mat in zip(unique_members['Nome'], unique_members['Matrícula']):
-            color = Config.COLOR_UNAVAILABLE if mat in occupied_ids else Config.COLOR_AVAILABLE
-            weight = "bold" if color == Config.COLOR_AVAILABLE else "normal"
-            y_labels.append(f'<span style="color:{color}; font-weight:{weight}">{nome}</span>')
-
-        # Gráfico Base
-        fig = px.timeline(
-            combined_df,
-            x_start="Início", x_end="Término", y="Nome",
-            color="Tipo",
-            color_discrete_map=Config.COLOR_MAP,
-            category_orders={"Nome": y_order},
-            hover_data=["Disciplina", "Projeto", "Detalhamento"]
-        )
+        # Criar labels coloridos HTML (concatenação vetorizada)
+        ocupado = unique_members['Matrícula'].isin(occupied_ids).to_numpy()
+        cor = np.where(ocupado, Config.COLOR_UNAVAILABLE, Config.COLOR_AVAILABLE)
+        peso = np.where(ocupado, "normal", "bold")
+        y_labels = (
+            '<span style="color:' + pd.Series(cor, index=unique_members.index) +
+            '; font-weight:' + peso + '">' + unique_members['Nome'].astype(str) + '</span>'
+        ).tolist()
+
+        # Sem eventos na janela: só eixos, divisores e linha "Hoje" (nada de hover/barras
+        # sobre colunas vazias, que com Copy-on-Write no pandas 2.2 quebram o astype)
+        traces = []
+        if not combined_df.empty:
+            # Fundir barras contíguas (menos barras no navegador); os eventos já chegam
+            # restritos à janela do gráfico por prepare_combined_data
+            combined_df = DataProcessor.coalesce_events(combined_df)
+
+            # Texto de hover pré-formatado (uma string por barra, sem template no navegador)
+            hover = (
+                combined_df['Nome'].astype('string') + '<br>' +
+                combined_df['Tipo'].astype('string') + ' · ' +
+                combined_df['Início'].dt.strftime('%d/%m/%Y') + ' → ' +
+                combined_df['Término'].dt.strftime('%d/%m/%Y') + '<br>' +
+                combined_df['Disciplina'].astype('string').fillna('-') + ' / ' +
+                combined_df['Projeto'].astype('string').fillna('-') +
+                ('<br>' + combined_df['Detalhamento'].astype('string')).fillna('')
+            )
 
-        # Estilização
-        fig.update_traces(marker=dict(line=dict(width=1, color='black')), selector=dict(type='bar'))
-        
-        # Layout
-        fig.update_layout(
-            height=max(600, len(y_order) * 30), # Altura dinâmica
-            xaxis_range=[start_date - timedelta(days=2), end_date + timedelta(days=2)],
-            yaxis=dict(
-                tickmode='array', tickvals=y_order, ticktext=y_labels,
-                gridcolor='lightgrey'
-            ),
-            xaxis=dict(gridcolor='lightgrey', title="Data"),
-            plot_bgcolor='white',
-            title="Cronograma de Alocação",
-            legend_title="Atividade"
+            # Barras: uma horizontal por Tipo (base = Início, comprimento em ms),
+            # na ordem das categorias de Tipo (agrupamento pelos códigos inteiros)
+            traces = [
+                go.Bar(
+                    y=grp['Nome'],
+                    base=grp['Início'],
+                    x=(grp['Término'] - grp['Início']).dt.total_seconds() * 1000,
+                    orientation='h',
+                    name=str(tipo),
+                    marker=dict(color=Config.COLOR_MAP.get(tipo), line=dict(width=1, color='black')),
+                    hovertext=hover[grp.index],
+                    hoverinfo='text'
+                )
+                for tipo, grp in combined_df.groupby('Tipo', observed=True, sort=True)
+            ]
+
+        # Divisores de Disciplina (fronteiras via cumsum)
+        sizes = (
+            unique_members['Disciplina'].value_counts()
+            .reindex(list(reversed(Config.DISCIPLINA_ORDER)), fill_value=0)
         )
+        sizes = sizes[sizes > 0]
+        fronteiras = sizes.cumsum() - 0.5
+        shapes = [
+            dict(type="line", xref="paper", x0=0, x1=1, yref="y", y0=y, y1=y,
+                 line=dict(dash="dot", color=Config.COLOR_SECTION_LINE))
+            for y in fronteiras
+        ]
+        annotations = [
+            dict(x=1, y=y - count / 2, text=f"<b>{disc}</b>",
+                 xref="paper", yref="y", xanchor="right", showarrow=False)
+            for disc, y, count in zip(sizes.index, fronteiras, sizes)
+        ]
 
         # Linha "Hoje"
-        hoje = datetime.now()
-        fig.add_vline(x=hoje.timestamp() * 1000, line_width=2, line_dash="dash", line_color="red", annotation_text="Hoje")
-        
-        # Divisores de Disciplina
-        y_pos = 0
-        for disc in reversed(Config.DISCIPLINA_ORDER):
-            count = len(unique_members[unique_members['Disciplina'] == disc])
-            if count > 0:
-                y_pos += count
-                fig.add_hline(y=y_pos - 0.5, line_dash="dot", line_color="black")
-                fig.add_annotation(x=1, y=y_pos - (count/2) - 0.5, text=f"<b>{disc}</b>", 
-                                 xref="paper", yref="y", xanchor="right", showarrow=False)
+        hoje = pd.Timestamp.now() # O eixo x é de datas: o Plotly aceita o Timestamp direto
+        shapes.append(dict(type="line", xref="x", x0=hoje, x1=hoje, yref="y domain", y0=0, y1=1,
+                           line=dict(width=2, dash="dash", color=Config.COLOR_TODAY_LINE)))
+        annotations.append(dict(x=hoje, y=1, text="Hoje", xref="x", yref="y domain",
+                                xanchor="left", yanchor="top", showarrow=False))
+
+        # Figura montada de uma vez (sem update_layout/add_* sucessivos)
+        fig = go.Figure(
+            data=traces,
+            layout=dict(
+                height=max(600, len(y_order) * 30), # Altura dinâmica
+                barmode='overlay',
+                xaxis=dict(
+                    type='date', gridcolor='lightgrey', title="Data",
+                    range=[start_date - timedelta(days=2), end_date + timedelta(days=2)]
+                ),
+                yaxis=dict(
+                    # Categorias de baixo para cima: o primeiro membro fica no topo
+                    categoryorder='array', categoryarray=y_order[::-1],
+                    tickmode='array', tickvals=y_order, ticktext=y_labels,
+                    gridcolor='lightgrey', title="Nome"
+                ),
+                shapes=shapes,
+                annotations=annotations,
+                plot_bgcolor='white',
+                title="Cronograma de Alocação",
+                legend_title="Atividade"
+            )
+        )
 
         return fig
 
@@ -350,10 +563,10 @@ class App:
         with st.sidebar:
             st.header("Filtros")
             
-            # Carregar dados
-            equipe_df, plan_df = DataLoader.load_estaleiro_data()
-            ferias_df = DataLoader.load_ferias_data()
-            geral_df = DataLoader.load_planejamento_geral()
+            # Carregar dados (mtime na chave do cache: planilha alterada -> recarrega)
+            equipe_df, plan_df = DataLoader.load_estaleiro_data(DataLoader.file_mtime(Config.FILE_PATH_ESTALEIRO))
+            ferias_df = DataLoader.load_ferias_data(DataLoader.file_mtime(Config.FILE_PATH_FERIAS))
+            geral_df = DataLoader.load_planejamento_geral(DataLoader.file_mtime(Config.FILE_PATH_GERAL))
 
             if equipe_df is None:
                 st.error("Falha ao carregar arquivo principal (Estaleiro).")
@@ -374,31 +587,38 @@ class App:
             only_available = st.checkbox("Apenas Disponíveis", help="Mostra quem não tem nada agendado no período")
 
         # 2. Processamento
-        # Filtragem inicial da equipe
-        equipe_filtered = equipe_df[
-            (equipe_df['Disciplina'].isin(sel_discs)) & 
-            (equipe_df['Projeto'].isin(sel_projs))
-        ].copy()
+        # Filtragem inicial da equipe (filtro com todas as opções selecionadas não gera máscara)
+        equipe_filtered = equipe_df
+        if set(sel_discs) != set(all_discs):
+            equipe_filtered = equipe_filtered[equipe_filtered['Disciplina'].isin(sel_discs)]
+        if set(sel_projs) != set(all_projs):
+            equipe_filtered = equipe_filtered[equipe_filtered['Projeto'].isin(sel_projs)]
 
         if equipe_filtered.empty:
             st.warning("Nenhum colaborador encontrado com os filtros atuais.")
             return
 
-        # Combinar eventos (apenas para a equipe filtrada para economizar processamento)
+        # Combinar eventos da equipe filtrada: sem janela para o relatório de conflitos
+        # (não depende das datas escolhidas, então o cache vale ao mudar o período)
+        # e restrito à janela que o gráfico exibe para a visualização
+        dfs_eventos = [plan_df, ferias_df, geral_df]
+        all_events_df, _ = DataProcessor.prepare_combined_data(equipe_filtered, dfs_eventos)
         combined_df, unique_members = DataProcessor.prepare_combined_data(
-            equipe_filtered, [plan_df, ferias_df, geral_df]
+            equipe_filtered, dfs_eventos,
+            d_inicio - timedelta(days=Config.EXTENDED_LOOKBEHIND_DAYS),
+            d_fim + timedelta(days=Config.EXTENDED_LOOKAHEAD_DAYS)
         )
 
-        # Lógica de Disponibilidade (Set-based, muito rápida)
+        # Lógica de Disponibilidade (isin vetorizado, muito rápida)
         # Identificar IDs ocupados no período selecionado
-        mask_ocupados = (combined_df['Início'] <= d_fim) & (combined_df['Término'] >= d_inicio)
-        occupied_ids = set(combined_df.loc[mask_ocupados, 'Matrícula'].unique())
+        occupied_ids = DataProcessor.get_occupied_ids(combined_df, d_inicio, d_fim)
 
         if only_available:
-            # Filtra unique_members para manter apenas quem NÃO está no set occupied_ids
+            # Filtra unique_members para manter apenas quem NÃO está em occupied_ids
             unique_members = unique_members[~unique_members['Matrícula'].isin(occupied_ids)]
             # Refiltra o combined para o gráfico não mostrar barras de quem foi removido
             combined_df = combined_df[combined_df['Matrícula'].isin(unique_members['Matrícula'])]
+            all_events_df = all_events_df[all_events_df['Matrícula'].isin(unique_members['Matrícula'])]
 
         if unique_members.empty:
             st.info("Nenhum colaborador disponível para os critérios selecionados.")
@@ -408,24 +628,15 @@ class App:
         tab_grafico, tab_conflitos = st.tabs(["Cronograma", "Relatório de Conflitos"])
 
         with tab_grafico:
-            # Filtrar dados para o gráfico (apenas o necessário)
-            chart_df = combined_df[combined_df['Matrícula'].isin(unique_members['Matrícula'])].copy()
-            
-            # Ordenação do gráfico baseada na lista de membros únicos
-            chart_df['Nome'] = pd.Categorical(
-                chart_df['Nome'], 
-                categories=unique_members['Nome'], 
-                ordered=True
-            )
-            chart_df = chart_df.sort_values('Nome')
-
+            # combined_df já está restrito aos membros de unique_members (filtro acima).
+            # A ordem do eixo vem do categoryarray do eixo y, sem ordenar os eventos.
             fig = Visualizer.create_gantt_chart(
-                chart_df, unique_members, d_inicio, d_fim, occupied_ids
+                combined_df, unique_members, d_inicio, d_fim, occupied_ids
             )
             st.plotly_chart(fig, use_container_width=True)
 
         with tab_conflitos:
-            conflicts_df = DataProcessor.detect_conflicts_vectorized(combined_df)
+            conflicts_df = DataProcessor.detect_conflicts_vectorized(all_events_df)
             if conflicts_df.empty:
                 st.success("✅ Nenhum conflito de agendamento detectado.")
             else: